@@ -1,26 +1,54 @@
+from collections import defaultdict
+import click
+import jwt
+import sqlalchemy as sa
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from os import path
 from .config import config_dict
+from .json_provider import OrjsonFallbackProvider
+from .session import BindableSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': BindableSession})
 
 def create_app(config_name):
   app = Flask(__name__)
+  app.json = OrjsonFallbackProvider(app)
   app.config.from_object(config_dict[config_name])
+  app.extensions['jwt'] = jwt.PyJWT()
   db.init_app(app)
 
+  from .auth_utils import init_token_cache
+  init_token_cache(app)
+
   from .auth import auth
   app.register_blueprint(auth, url_prefix="/auth/")
 
-  from .models import User
+  from .models import User, normalize_username
   
 
-  create_database(app)
+  @app.cli.command("init-db")
+  def init_db_command():
+    """Create the database tables."""
+    db.create_all()
 
-  return app
+  @app.cli.command("normalize-usernames")
+  def normalize_usernames_command():
+    """Normalize existing usernames in place, skipping any that would collide."""
+    groups = defaultdict(list)
+    for row in db.session.execute(sa.select(User.id, User.user)):
+      groups[normalize_username(row.user)].append(row)
+
+    mappings = []
+    for normalized, rows in groups.items():
+      if len(rows) > 1:
+        names = ", ".join(repr(row.user) for row in rows)
+        click.echo(f"Skipping {names}: they all normalize to {normalized!r}", err=True)
+      elif rows[0].user != normalized:
+        mappings.append({'id': rows[0].id, 'user': normalized})
 
-def create_database(app):
-  with app.app_context():
-    if not path.exists('app/' + app.config["DB_NAME"]):
-      db.create_all()
\ No newline at end of file
+    if mappings:
+      db.session.execute(sa.update(User), mappings)
+      db.session.commit()
+    click.echo(f"Normalized {len(mappings)} username(s)")
+
+  return app
@@ -1,13 +1,47 @@
-from flask import Blueprint, request, jsonify, current_app
-from .models import User
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, Response, request, jsonify, current_app
+from .models import User, normalize_username
+from argon2.exceptions import InvalidHashError, VerificationError, VerifyMismatchError
+from .auth_utils import get_jwt_key
+from .hashing import ph, hash_password, verify_password, verify_legacy
 from . import db
-import jwt
-import datetime
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+import orjson
+import time
 
 # Create a Flask Blueprint for authentication
 auth = Blueprint('auth', __name__)
 
+# Fields each route expects in the request body
+_LOGIN_REQUIRED = ('user', 'password')
+_SIGNUP_REQUIRED = ('user', 'password', 'first_name')
+
+# Lifetime in seconds of the JWT tokens issued on login
+_JWT_TTL = 3600
+
+# Error bodies returned on every failed request, serialized once at import time
+_ERR_INVALID_JSON = orjson.dumps({'error': 'Invalid JSON body'})
+_ERR_INVALID_CREDENTIALS = orjson.dumps({'error': 'Invalid credentials'})
+_ERR_USER_EXISTS = orjson.dumps({'error': 'This user already exists'})
+
+def _error_response(body):
+    """
+    Build a 400 response around a pre-serialized error body.
+
+    A new Response is created for each request so after-request handlers can
+    safely modify it; only the JSON encoding is shared.
+
+    Args:
+        body (bytes): The serialized JSON error body.
+
+    Returns:
+        Response: A 400 Bad Request JSON response.
+    """
+    return Response(body, status=400, mimetype='application/json')
+
+# Verified against when the user does not exist, so both login failure paths cost the same
+_DUMMY_HASH = ph.hash("x" * 16)
+
 @auth.route('/login', methods=["POST"])
 def login():
     """
@@ -25,31 +59,63 @@ def login():
 
     Returns:
     - 200 OK: Login successful with JWT token.
-    - 400 Bad Request: If required fields are missing, user not found, or incorrect password.
+    - 400 Bad Request: If the body is not a JSON object, required fields are missing, or the credentials are invalid.
     """
-    data = request.get_json()
+    data = request.get_json(silent=True, cache=True)
+    if not isinstance(data, dict):
+        return _error_response(_ERR_INVALID_JSON)
+
     errors = {}
 
+    # Normalize the username first so a whitespace-only name is rejected as empty
+    if 'user' in data:
+        data['user'] = normalize_username(data['user'])
+
     # Check for required fields
-    required_fields = ['user', 'password']
-    for field in required_fields:
+    for field in _LOGIN_REQUIRED:
         if field not in data:
             errors[field] = f"{field.capitalize()} is required"
+        elif not isinstance(data[field], str) or not data[field]:
+            errors[field] = f"{field.capitalize()} must be a non-empty string"
 
     if errors:
         return jsonify({'errors': errors}), 400
 
-    user = User.query.filter_by(user=data['user']).first()
-
-    if not user:
-        return jsonify({'error': 'User not found'}), 400
-
-    if not check_password_hash(user.password, data['password']):
-        return jsonify({'error': 'Incorrect password'}), 400
+    # Only load the columns needed to verify the credentials
+    user = db.session.execute(
+        sa.select(User.id, User.password).where(User.user == data['user'])).first()
+
+    # Always run a full verification so unknown users cannot be told apart by timing
+    stored = user.password if user else _DUMMY_HASH
+    ok = needs_rehash = False
+    try:
+        verify_password(stored, data['password'])
+        ok = user is not None
+        # Upgrade the stored hash if the hashing parameters have changed
+        needs_rehash = ok and ph.check_needs_rehash(stored)
+    except InvalidHashError:
+        # Hashes from before the Argon2 migration are upgraded once verified
+        ok = needs_rehash = verify_legacy(stored, data['password'])
+        # Pay for a full Argon2 verification too, so legacy accounts cost the same as the others
+        try:
+            verify_password(_DUMMY_HASH, data['password'])
+        except VerifyMismatchError:
+            pass
+    except VerificationError:
+        # Wrong passwords and corrupt Argon2 hashes both fail the check
+        pass
+
+    if not ok:
+        return _error_response(_ERR_INVALID_CREDENTIALS)
+
+    if needs_rehash:
+        db.session.execute(
+            sa.update(User).where(User.id == user.id).values(password=hash_password(data['password'])))
+        db.session.commit()
 
     # Generate a JWT token
-    secret_key = current_app.config['SECRET_KEY']
-    token = jwt.encode({'user_id': user.id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)}, secret_key, algorithm='HS256')
+    token = current_app.extensions['jwt'].encode(
+        {'user_id': user.id, 'exp': int(time.time()) + _JWT_TTL}, get_jwt_key(current_app), algorithm='HS256')
 
     response = {'message': 'Login successful', 'token': token}
     return jsonify(response), 200
@@ -60,8 +126,8 @@ def sign_up():
     Handle user registration.
 
     This route accepts a POST request with user registration data (username, password, and first_name) 
-    in the request body. It checks if the user already exists, and if not, creates a new user record 
-    in the database.
+    in the request body. It creates a new user record in the database, rejecting the request 
+    if the user already exists.
 
     Request JSON:
     {
@@ -72,16 +138,24 @@ def sign_up():
 
     Returns:
     - 200 OK: Signup successful with a success message.
-    - 400 Bad Request: If required fields are missing or if the user already exists.
+    - 400 Bad Request: If the body is not a JSON object, required fields are missing, or the user already exists.
     """
-    data = request.get_json()
+    data = request.get_json(silent=True, cache=True)
+    if not isinstance(data, dict):
+        return _error_response(_ERR_INVALID_JSON)
+
     errors = {}
 
+    # Normalize the username first so a whitespace-only name is rejected as empty
+    if 'user' in data:
+        data['user'] = normalize_username(data['user'])
+
     # Check for required fields
-    required_fields = ['user', 'password', 'first_name']
-    for field in required_fields:
+    for field in _SIGNUP_REQUIRED:
         if field not in data:
             errors[field] = f"{field.capitalize()} is required"
+        elif not isinstance(data[field], str) or not data[field]:
+            errors[field] = f"{field.capitalize()} must be a non-empty string"
     
     if errors:
         return jsonify({'errors': errors}), 400
@@ -90,15 +164,14 @@ def sign_up():
     password = data['password']
     first_name = data['first_name']
 
-    # Check if the user already exists
-    user_found = User.query.filter_by(user=data['user']).first()
-    if user_found:
-        return jsonify({'error': 'This user already exists'}), 400
-
-    # Create a new user record
-    new_user = User(user=user, password=generate_password_hash(password=password, method='sha256'), first_name=first_name)
-    db.session.add(new_user)
-    db.session.commit()
+    # Create a new user record, relying on the unique constraint to reject duplicates;
+    # the field checks above leave it as the only constraint the insert can violate
+    try:
+        db.session.execute(sa.insert(User).values(user=user, password=hash_password(password), first_name=first_name))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return _error_response(_ERR_USER_EXISTS)
 
     response = {'message': 'Signup successful', 'user': user}
     return jsonify(response), 200
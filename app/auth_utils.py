@@ -1,17 +1,79 @@
 import jwt
+import hashlib
+import threading
+import time
+from types import MappingProxyType
 from functools import wraps
-from flask import request, jsonify, current_app
+from cachetools import TTLCache
+from flask import request, jsonify, current_app, g
+from . import db
 from .models import User  # Adjust the import as needed
 
+# Guards the per-app verified-token caches, which are not thread-safe
+_TOKEN_CACHE_LOCK = threading.RLock()
+
+def init_token_cache(app):
+    """
+    Create the verified-token cache for an application.
+
+    The cache maps the SHA-256 digest of a token to the payload obtained from
+    its last successful verification, so repeated requests with
+    the same token skip the signature check. Its size and lifetime are read from
+    the ``JWT_CACHE_MAXSIZE`` and ``JWT_CACHE_TTL`` configuration values.
+
+    Args:
+        app (Flask): The application to attach the cache to.
+    """
+    app.extensions['token_cache'] = TTLCache(
+        maxsize=app.config['JWT_CACHE_MAXSIZE'], ttl=app.config['JWT_CACHE_TTL'])
+
+def get_jwt_key(app):
+    """
+    Return the application's SECRET_KEY encoded for signing tokens.
+
+    The encoded key is derived on first use and kept in ``app.extensions``; it
+    is derived again whenever ``SECRET_KEY`` changes, so a key set after
+    `create_app` returns is still honored.
+
+    Args:
+        app (Flask): The application whose signing key is needed.
+
+    Returns:
+        bytes: The encoded signing key.
+    """
+    secret_key = app.config['SECRET_KEY']
+    cached = app.extensions.get('jwt_key')
+    if cached is None or cached[0] != secret_key:
+        cached = app.extensions['jwt_key'] = (secret_key, secret_key.encode())
+    return cached[1]
+
+def get_current_user():
+    """
+    Return the user authenticated by `token_required` for the current request.
+
+    Returns:
+        User: The authenticated user, or None outside a protected route.
+    """
+    return g.get('current_user')
+
 def token_required(f):
     """
     Decorator to protect routes by requiring a valid JWT token.
 
     This decorator checks for the presence of a JWT token in the 'Authorization' header 
-    of the incoming request. It verifies the token's validity and decodes it to obtain 
-    the user's ID. If the token is valid, it retrieves the current user and passes it 
+    of the incoming request, with or without a 'Bearer ' prefix. It verifies the token's 
+    validity and decodes it to obtain the user's ID; both the 'exp' and 'user_id' claims 
+    are required. If the token is valid, it retrieves the current user and passes it 
     as an argument to the decorated route function.
 
+    The verified payload and user are also stored on `flask.g` as `g.jwt_payload` and
+    `g.current_user`. Code that needs the token claims must read `g.jwt_payload`
+    instead of decoding the token again. `g.jwt_payload` is a plain dict copied per
+    request; the token cache keeps its own read-only copy.
+
+    Recently verified tokens are kept in a short-lived cache keyed by their SHA-256
+    digest; on a cache hit only the expiry is re-checked.
+
     Args:
         f (function): The decorated route function.
 
@@ -25,10 +87,31 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Token is missing'}), 401
 
+        if token.startswith('Bearer '):
+            token = token[len('Bearer '):]
+        token = token.strip()
+        token_cache = current_app.extensions['token_cache']
+        cache_key = hashlib.sha256(token.encode()).digest()
+
+        with _TOKEN_CACHE_LOCK:
+            cached = token_cache.get(cache_key)
+
+        if cached is not None:
+            data = cached
+            if data['exp'] <= time.time():
+                with _TOKEN_CACHE_LOCK:
+                    token_cache.pop(cache_key, None)
+                return jsonify({'error': 'Token has expired'}), 401
+            current_user = db.session.get(User, data['user_id'])
+            g.jwt_payload = dict(data)
+            g.current_user = current_user
+            return f(current_user, *args, **kwargs)
+
         try:
-            secret_key = current_app.config['SECRET_KEY']
-            data = jwt.decode(token, secret_key, algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
+            data = current_app.extensions['jwt'].decode(
+                token, get_jwt_key(current_app), algorithms=['HS256'],
+                options={'require': ['exp', 'user_id']})
+            current_user = db.session.get(User, data['user_id'])
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token has expired'}), 401
         except jwt.InvalidTokenError:
@@ -36,6 +119,13 @@ def token_required(f):
         except Exception as e:
             return jsonify({'error': 'Token verification failed'}), 401
 
+        # Only tokens that passed verification are cached, read-only so views cannot alter them
+        data = MappingProxyType(data)
+        with _TOKEN_CACHE_LOCK:
+            token_cache[cache_key] = data
+
+        g.jwt_payload = dict(data)
+        g.current_user = current_user
         return f(current_user, *args, **kwargs)
 
-    return decorated
\ No newline at end of file
+    return decorated
@@ -1,4 +1,5 @@
 import os
+from sqlalchemy.pool import StaticPool
 
 # Get the base directory of the application
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -14,9 +15,20 @@ class Config:
     Attributes:
         SECRET_KEY (str): The secret key used for session and data security.
         SQLALCHEMY_TRACK_MODIFICATIONS (bool): Controls whether to track modifications in SQLAlchemy.
+        JWT_CACHE_TTL (int): Seconds a verified token is cached before it is verified again.
+        JWT_CACHE_MAXSIZE (int): Maximum number of verified tokens kept in the cache.
+        SQLALCHEMY_ENGINE_OPTIONS (dict): Connection pool tuning for server databases.
     """
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'super_ultra_secret'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    JWT_CACHE_TTL = 10
+    JWT_CACHE_MAXSIZE = 10_000
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 20,
+        'max_overflow': 20,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+    }
 
 # Example of how to set up different database configurations for different stages
 class DevelopmentConfig(Config):
@@ -30,10 +42,12 @@ class DevelopmentConfig(Config):
         DEBUG (bool): Controls whether the application runs in debug mode.
         DB_NAME (str): The name of the development database.
         SQLALCHEMY_DATABASE_URI (str): The URI for connecting to the development database.
+        SQLALCHEMY_ENGINE_OPTIONS (dict): SQLite needs no pool tuning, only cross-thread connection use.
     """
     DEBUG = True
     DB_NAME = "development.db"
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{DB_NAME}'
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'check_same_thread': False}}
 
 class TestingConfig(Config):
     """
@@ -44,12 +58,15 @@ class TestingConfig(Config):
 
     Attributes:
         TESTING (bool): Controls whether the application is in testing mode.
-        DB_NAME (str): The name of the test database.
-        SQLALCHEMY_DATABASE_URI (str): The URI for connecting to the test database.
+        SQLALCHEMY_DATABASE_URI (str): The URI for connecting to the in-memory test database.
+        SQLALCHEMY_ENGINE_OPTIONS (dict): Share a single connection so every session sees the same in-memory database.
     """
     TESTING = True
-    DB_NAME = "test.db"
-    SQLALCHEMY_DATABASE_URI = f'sqlite:///{DB_NAME}'
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'connect_args': {'check_same_thread': False},
+        'poolclass': StaticPool,
+    }
 
 class ProductionConfig(Config):
     """
@@ -0,0 +1,65 @@
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from argon2 import PasswordHasher
+
+# Argon2id hasher shared by the authentication routes.
+# Parameters follow the OWASP 46 MiB / t=1 / p=1 profile.
+ph = PasswordHasher(time_cost=1, memory_cost=46 * 1024, parallelism=1, hash_len=32)
+
+# Bounded pool for hashing work. argon2-cffi releases the GIL, so threads run
+# hashes in parallel, and the pool caps how many 46 MiB hashes run at once.
+_HASH_POOL = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='argon2')
+
+def hash_password(password):
+    """
+    Hash a password on the hashing pool.
+
+    Args:
+        password (str): The plaintext password.
+
+    Returns:
+        str: The encoded Argon2id hash.
+    """
+    return _HASH_POOL.submit(ph.hash, password).result()
+
+def verify_password(stored, password):
+    """
+    Verify a password against a stored hash on the hashing pool.
+
+    Args:
+        stored (str): The encoded hash to verify against.
+        password (str): The plaintext password.
+
+    Returns:
+        bool: True if the password matches.
+
+    Raises:
+        argon2.exceptions.VerifyMismatchError: If the password does not match.
+    """
+    return _HASH_POOL.submit(ph.verify, stored, password).result()
+
+def verify_legacy(stored, password):
+    """
+    Verify a password against a legacy Werkzeug ``sha256$salt$hash`` hash.
+
+    Rows created before the Argon2 migration hold hashes produced by
+    `generate_password_hash(..., method='sha256')`, which is an HMAC-SHA256 of
+    the password keyed by the salt. The digests are compared in constant time.
+
+    Args:
+        stored (str): The legacy encoded hash.
+        password (str): The plaintext password.
+
+    Returns:
+        bool: True if the password matches, False otherwise or if the hash is
+        not in the legacy format.
+    """
+    try:
+        method, salt, stored_hash = stored.split('$', 2)
+    except ValueError:
+        return False
+    if method != 'sha256':
+        return False
+    recomputed = hmac.new(salt.encode(), password.encode(), method).hexdigest()
+    return hmac.compare_digest(recomputed, stored_hash)
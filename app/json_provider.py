@@ -0,0 +1,18 @@
+import json
+import orjson
+from flask_orjson import OrjsonProvider
+
+class OrjsonFallbackProvider(OrjsonProvider):
+    """
+    JSON provider for the application.
+
+    Responses and request bodies (through `request.get_json`) are handled by
+    orjson. Bodies orjson rejects, such as UTF-16/UTF-32 encoded JSON, are
+    retried with the standard library parser before being treated as invalid.
+    """
+
+    def loads(self, s, **kwargs):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            return json.loads(s)
@@ -1,5 +1,23 @@
 from . import db 
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
+
+def normalize_username(value):
+    """
+    Normalize a username for storage and lookup.
+
+    Usernames are stripped and case-folded so that equality checks can use the
+    index on the `user` column directly. Non-string values are returned as is.
+
+    Args:
+        value (str): The username to normalize.
+
+    Returns:
+        str: The normalized username.
+    """
+    if isinstance(value, str):
+        return value.strip().casefold()
+    return value
 
 class User(db.Model, UserMixin):
     """
@@ -10,11 +28,17 @@ class User(db.Model, UserMixin):
 
     Attributes:
         id (int): The unique identifier for each user.
-        user (str): The username for the user, must be unique.
+        user (str): The username for the user, must be unique. Stored normalized with `normalize_username`.
         password (str): The hashed password for the user.
         first_name (str): The first name of the user.
     """
+    __table_args__ = (db.Index('ix_user_user', 'user'),)
+
     id = db.Column(db.Integer, primary_key=True)
     user = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(150), nullable=False)
-    first_name = db.Column(db.String(150))
\ No newline at end of file
+    password = db.Column(db.String(255), nullable=False)
+    first_name = db.Column(db.String(150))
+
+    @validates('user')
+    def validate_user(self, key, value):
+        return normalize_username(value)
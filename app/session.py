@@ -0,0 +1,15 @@
+from flask_sqlalchemy.session import Session
+
+class BindableSession(Session):
+    """
+    Flask-SQLAlchemy session that honors an explicit bind.
+
+    Flask-SQLAlchemy always routes queries to the app's engine. When the session
+    factory is configured with a ``bind`` (for example a connection holding an
+    outer transaction in tests), that bind is used instead.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.bind is not None:
+            return self.bind
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
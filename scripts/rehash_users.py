@@ -0,0 +1,109 @@
+"""
+Bulk-set user passwords with the application's Argon2id profile.
+
+Stored hashes cannot be upgraded without the plaintext, so this script takes a
+CSV file of ``user,password`` rows (for example from a forced password reset or
+an import from another system), with an optional header row, and re-hashes the
+matching users in parallel.
+argon2-cffi releases the GIL while hashing, so a thread pool scales across cores.
+Each concurrent hash uses the profile's full ``memory_cost``.
+
+Usage (from the repository root):
+
+    python -m scripts.rehash_users passwords.csv --config production
+"""
+import argparse
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+
+from app import create_app, db
+from app.hashing import ph
+from app.models import User, normalize_username
+
+STREAM_CHUNK_SIZE = 1000
+UPDATE_BATCH_SIZE = 500
+
+def load_passwords(path):
+    """
+    Read the new passwords from a CSV file.
+
+    An optional ``user,password`` header row is skipped. Every other row must
+    have exactly two fields.
+
+    Args:
+        path (str): Path to a CSV file whose rows are ``user,password``.
+
+    Returns:
+        dict: Mapping of username to new plaintext password.
+
+    Raises:
+        ValueError: If a row does not have exactly two fields.
+    """
+    passwords = {}
+    with open(path, newline='') as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if not row:
+                continue
+            if line_number == 1 and [field.strip().lower() for field in row] == ['user', 'password']:
+                continue
+            if len(row) != 2:
+                raise ValueError(
+                    f"{path}, line {line_number}: expected 2 fields (user,password), got {len(row)}")
+            passwords[normalize_username(row[0])] = row[1]
+    return passwords
+
+def rehash_users(passwords, max_workers=None, batch_size=UPDATE_BATCH_SIZE):
+    """
+    Hash and store new passwords for the given users.
+
+    Users are streamed from the database in chunks, the passwords of the
+    matching users are hashed on a thread pool, and the results are written
+    back with batched UPDATE statements. Must run inside an application context.
+
+    Args:
+        passwords (dict): Mapping of username to new plaintext password.
+        max_workers (int): Number of hashing threads, defaults to the CPU count.
+        batch_size (int): Number of rows written per UPDATE batch.
+
+    Returns:
+        int: The number of users updated.
+    """
+    rows = db.session.execute(
+        sa.select(User.id, User.user).execution_options(yield_per=STREAM_CHUNK_SIZE))
+    pending = [(row.id, passwords[row.user]) for row in rows if row.user in passwords]
+
+    updated = 0
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            hashes = pool.map(ph.hash, [password for _, password in batch])
+            mappings = [{'id': user_id, 'password': hashed}
+                        for (user_id, _), hashed in zip(batch, hashes)]
+            db.session.execute(sa.update(User), mappings)
+            db.session.commit()
+            updated += len(mappings)
+
+    return updated
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('csv_path', help='CSV file of user,password rows')
+    parser.add_argument('--config', default='default', help='Configuration name to load')
+    parser.add_argument('--workers', type=int, default=None, help='Number of hashing threads')
+    args = parser.parse_args()
+
+    try:
+        passwords = load_passwords(args.csv_path)
+    except ValueError as e:
+        parser.error(str(e))
+
+    app = create_app(args.config)
+    with app.app_context():
+        updated = rehash_users(passwords, max_workers=args.workers)
+    print(f"Updated {updated} user(s)")
+
+if __name__ == '__main__':
+    main()
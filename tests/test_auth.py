@@ -1,27 +1,103 @@
 import pytest
+import jwt
+import orjson
+import sqlalchemy as sa
 from app import create_app, db
 from app.models import User
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.auth_utils import token_required, get_current_user
+from flask import jsonify, g
+from app.hashing import ph
+from argon2 import PasswordHasher
+from scripts.rehash_users import load_passwords, rehash_users
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+def register_test_routes(app):
+    """
+    Register routes protected by `token_required` on the test app.
+
+    Args:
+        app (Flask): The application under test.
+
+    Returns:
+        None
+    """
+    @app.route('/protected')
+    @token_required
+    def protected(current_user):
+        return jsonify({'user': current_user.user}), 200
+
+    @app.route('/claims')
+    @token_required
+    def claims(user):
+        return jsonify({'user_id': g.jwt_payload['user_id'], 'user': get_current_user().user}), 200
+
+    @app.route('/payload')
+    @token_required
+    def payload(user):
+        return jsonify(g.jwt_payload), 200
+
+@pytest.fixture(scope='session')
+def app():
+    """
+    Create the app once for the whole test session.
+
+    This fixture builds the testing application, registers the test routes and
+    creates the database tables a single time. pysqlite's implicit transaction
+    handling is disabled so that SAVEPOINTs work and each test can be rolled back.
+    No app context is held, so every request gets a fresh one.
+
+    Returns:
+        Flask: The application under test.
+    """
+    app = create_app("testing")
+    register_test_routes(app)
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def disable_pysqlite_transactions(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(db.engine, 'begin')
+        def emit_begin(connection):
+            connection.exec_driver_sql('BEGIN')
+
+        db.create_all()
+
+    yield app
+
+    with app.app_context():
+        db.drop_all()
 
 @pytest.fixture
-def client():
+def client(app):
     """
     Create a test client for the app.
 
     This fixture sets up a Flask test client for testing the application.
-    It creates a testing database, sets up the application context, and drops
-    the database after testing.
+    Each test runs inside an outer transaction; the Flask-SQLAlchemy session
+    factory is configured to bind to its connection and commit to SAVEPOINTs
+    within it, and the outer transaction is rolled back after the test so no
+    data leaks between tests.
+    Test code that touches the database pushes its own app context.
 
     Returns:
         FlaskClient: A test client for making HTTP requests to the app.
     """
-    app = create_app("testing")
-
-    with app.test_client() as client:
-        with app.app_context():
-            db.create_all()
+    with app.app_context():
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        db.session.configure(bind=connection, join_transaction_mode='create_savepoint')
+    app.extensions['token_cache'].clear()
+
+    try:
+        with app.test_client() as client:
             yield client
-            db.drop_all()
+    finally:
+        with app.app_context():
+            db.session.configure(bind=None, join_transaction_mode='conservative_savepoint')
+        transaction.rollback()
+        connection.close()
 
 def test_registration_successful(client):
     """
@@ -65,10 +141,10 @@ def test_registration_duplicate_username(client):
         None
     """
     # --- Prepare a user with the same username ---
-    existing_user = User(user='existinguser', password=generate_password_hash(
-        password='password123', method='sha256'))
-    db.session.add(existing_user)
-    db.session.commit()
+    with client.application.app_context():
+        existing_user = User(user='existinguser', password=ph.hash('password123'))
+        db.session.add(existing_user)
+        db.session.commit()
 
     # Prepare the test data with a duplicate username
     data = {'user': 'existinguser', 'password': 'password456', 'first_name': 'Jane'}
@@ -95,10 +171,10 @@ def test_authentication_successful(client):
         None
     """
     # --- Prepare a user with known credentials ---
-    test_user = User(user='testuser', password=generate_password_hash(
-        password='hashed_password', method='sha256'))
-    db.session.add(test_user)
-    db.session.commit()
+    with client.application.app_context():
+        test_user = User(user='testuser', password=ph.hash('hashed_password'))
+        db.session.add(test_user)
+        db.session.commit()
 
     # Prepare the test data for the POST request
     data = {'user': 'testuser', 'password': 'hashed_password'}
@@ -127,10 +203,10 @@ def test_authentication_invalid_credentials(client):
         None
     """
     # --- Prepare a user with known credentials ---
-    test_user = User(user='testuser', password=generate_password_hash(
-        password='hashed_password', method='sha256'))
-    db.session.add(test_user)
-    db.session.commit()
+    with client.application.app_context():
+        test_user = User(user='testuser', password=ph.hash('hashed_password'))
+        db.session.add(test_user)
+        db.session.commit()
 
     # Prepare the test data with incorrect password
     data = {'user': 'testuser', 'password': 'incorrect_password'}
@@ -140,7 +216,7 @@ def test_authentication_invalid_credentials(client):
 
     # Check if the response status code is 400 (bad request) indicating incorrect credentials
     assert response.status_code == 400
-    assert 'error' in response.json
+    assert 'Invalid credentials' == response.json['error']
 
 def test_missing_required_fields_login(client):
     """
@@ -193,10 +269,10 @@ def test_duplicate_user(client):
         None
     """
     # --- Prepare a user with the same username ---
-    existing_user = User(user='testuser', password=generate_password_hash(
-        password='password123', method='sha256'))
-    db.session.add(existing_user)
-    db.session.commit()
+    with client.application.app_context():
+        existing_user = User(user='testuser', password=ph.hash('password123'))
+        db.session.add(existing_user)
+        db.session.commit()
 
     # Prepare a JSON payload with an existing username
     data = {'user': 'testuser', 'password': 'newpassword', 'first_name': 'John'}
@@ -266,8 +342,504 @@ def test_user_not_found(client):
     response = client.post('/auth/login', json=data)
 
     assert 'error' in response.json
-    assert 'User not found' == response.json['error']
+    assert 'Invalid credentials' == response.json['error']
 
     # Check if the response status code is 400 (bad request) indicating user not found
     assert response.status_code == 400
-    assert 'error' in response.json
\ No newline at end of file
+    assert 'error' in response.json
+
+def test_password_rehashed_on_login(client):
+    """
+    Test that outdated password hashes are upgraded on login.
+
+    This test case stores a password hashed with weaker Argon2 parameters than
+    the current profile, logs in with the correct password, and checks that
+    the stored hash was replaced with one matching the current parameters.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    # --- Prepare a user whose hash uses outdated parameters ---
+    weak_hasher = PasswordHasher(time_cost=1, memory_cost=8 * 1024, parallelism=1)
+    with client.application.app_context():
+        test_user = User(user='testuser', password=weak_hasher.hash('hashed_password'))
+        db.session.add(test_user)
+        db.session.commit()
+        test_user_id = test_user.id
+
+    data = {'user': 'testuser', 'password': 'hashed_password'}
+
+    # Make a POST request to the login endpoint
+    response = client.post('/auth/login', json=data)
+    assert response.status_code == 200
+
+    # Check that the stored hash now matches the current parameters
+    with client.application.app_context():
+        stored_password = db.session.get(User, test_user_id).password
+    assert not ph.check_needs_rehash(stored_password)
+    ph.verify(stored_password, 'hashed_password')
+
+def test_token_required_caches_verified_token(client):
+    """
+    Test that a verified token is cached and reused on later requests.
+
+    This test case logs in, calls a protected route with the issued token and
+    checks that the token was stored in the verified-token cache and that a
+    second request with the same token is served from it.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    # --- Prepare a user with known credentials ---
+    with client.application.app_context():
+        test_user = User(user='testuser', password=ph.hash('hashed_password'))
+        db.session.add(test_user)
+        db.session.commit()
+
+    response = client.post('/auth/login', json={'user': 'testuser', 'password': 'hashed_password'})
+    token = response.json['token']
+
+    response = client.get('/protected', headers={'Authorization': token})
+    assert response.status_code == 200
+    assert response.json['user'] == 'testuser'
+
+    # Check that the verified token is now cached
+    token_cache = client.application.extensions['token_cache']
+    assert len(token_cache) == 1
+
+    # Check that the cached payload cannot be modified by views
+    with pytest.raises(TypeError):
+        next(iter(token_cache.values()))['user_id'] = 0
+
+    response = client.get('/protected', headers={'Authorization': token})
+    assert response.status_code == 200
+    assert response.json['user'] == 'testuser'
+
+def test_token_required_rejects_invalid_token(client):
+    """
+    Test that missing or invalid tokens are rejected and never cached.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    response = client.get('/protected')
+    assert response.status_code == 401
+    assert 'Token is missing' == response.json['error']
+
+    response = client.get('/protected', headers={'Authorization': 'not-a-token'})
+    assert response.status_code == 401
+    assert 'Token is invalid' == response.json['error']
+
+    # Check that the failed token was not cached
+    assert len(client.application.extensions['token_cache']) == 0
+
+def test_token_required_accepts_bearer_prefix(client):
+    """
+    Test that tokens sent with a 'Bearer ' prefix are accepted.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    # --- Prepare a user with known credentials ---
+    with client.application.app_context():
+        test_user = User(user='testuser', password=ph.hash('hashed_password'))
+        db.session.add(test_user)
+        db.session.commit()
+
+    response = client.post('/auth/login', json={'user': 'testuser', 'password': 'hashed_password'})
+    token = response.json['token']
+
+    response = client.get('/protected', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert response.json['user'] == 'testuser'
+
+def test_token_required_rejects_token_without_expiry(client):
+    """
+    Test that tokens missing the required 'exp' claim are rejected.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    secret_key = client.application.config['SECRET_KEY']
+    token = jwt.encode({'user_id': 1}, secret_key, algorithm='HS256')
+
+    response = client.get('/protected', headers={'Authorization': token})
+    assert response.status_code == 401
+    assert 'Token is invalid' == response.json['error']
+
+def test_invalid_json_body(client):
+    """
+    Test login and registration with a body that is not a JSON object.
+
+    This test case sends malformed JSON and JSON values that are not objects
+    to both endpoints and checks that a JSON error response is returned.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    for endpoint in ('/auth/login', '/auth/sign-up'):
+        # Malformed JSON
+        response = client.post(endpoint, data='{not json', content_type='application/json')
+        assert response.status_code == 400
+        assert 'Invalid JSON body' == response.json['error']
+
+        # Valid JSON that is not an object
+        response = client.post(endpoint, json=['user', 'password'])
+        assert response.status_code == 400
+        assert 'Invalid JSON body' == response.json['error']
+
+def test_bulk_rehash_users(client):
+    """
+    Test the bulk password rehash script.
+
+    This test case stores users with outdated hashes, runs `rehash_users` with
+    new passwords for some of them, and checks that only those users were
+    updated and can log in with their new password.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    # --- Prepare users with outdated hashes ---
+    weak_hasher = PasswordHasher(time_cost=1, memory_cost=8 * 1024, parallelism=1)
+    with client.application.app_context():
+        for name in ('alice', 'bob', 'carol'):
+            db.session.add(User(user=name, password=weak_hasher.hash('old_password')))
+        db.session.commit()
+
+        updated = rehash_users({'alice': 'new_alice', 'bob': 'new_bob', 'nobody': 'x'},
+                               max_workers=2, batch_size=1)
+    assert updated == 2
+
+    response = client.post('/auth/login', json={'user': 'alice', 'password': 'new_alice'})
+    assert response.status_code == 200
+    response = client.post('/auth/login', json={'user': 'bob', 'password': 'new_bob'})
+    assert response.status_code == 200
+
+    # Users without a new password keep their existing hash
+    response = client.post('/auth/login', json={'user': 'carol', 'password': 'old_password'})
+    assert response.status_code == 200
+
+def test_username_normalization(client):
+    """
+    Test that usernames are matched regardless of case and surrounding spaces.
+
+    This test case registers a user with a mixed-case username, checks that a
+    differently-cased registration is rejected as a duplicate, and logs in with
+    yet another spelling of the same username.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    data = {'user': '  NewUser ', 'password': 'password123', 'first_name': 'John'}
+    response = client.post('/auth/sign-up', json=data)
+    assert response.status_code == 200
+    assert response.json['user'] == 'newuser'
+
+    data = {'user': 'NEWUSER', 'password': 'password456', 'first_name': 'Jane'}
+    response = client.post('/auth/sign-up', json=data)
+    assert response.status_code == 400
+    assert 'This user already exists' == response.json['error']
+
+    data = {'user': 'newUser', 'password': 'password123'}
+    response = client.post('/auth/login', json=data)
+    assert response.status_code == 200
+    assert 'token' in response.json
+
+def test_legacy_sha256_hash_login(client):
+    """
+    Test login for a user whose password still has a legacy SHA-256 hash.
+
+    This test case stores a Werkzeug `sha256` hash, checks that a wrong password
+    is rejected, logs in with the correct password, and checks that the stored
+    hash was upgraded to Argon2id.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    # --- Prepare a user with a legacy hash ---
+    with client.application.app_context():
+        test_user = User(user='testuser', password=generate_password_hash(
+            password='hashed_password', method='sha256'))
+        db.session.add(test_user)
+        db.session.commit()
+        test_user_id = test_user.id
+
+    response = client.post('/auth/login', json={'user': 'testuser', 'password': 'incorrect_password'})
+    assert response.status_code == 400
+    assert 'Invalid credentials' == response.json['error']
+
+    response = client.post('/auth/login', json={'user': 'testuser', 'password': 'hashed_password'})
+    assert response.status_code == 200
+    assert 'token' in response.json
+
+    # Check that the stored hash was upgraded to Argon2id
+    with client.application.app_context():
+        stored_password = db.session.get(User, test_user_id).password
+    assert stored_password.startswith('$argon2id$')
+    ph.verify(stored_password, 'hashed_password')
+
+def test_token_required_stores_payload_on_g(client):
+    """
+    Test that the verified payload and user are available on `flask.g`.
+
+    This test case calls a protected route twice, once verifying the token and
+    once from the cache, and checks that the view can read the claims and the
+    user without decoding the token again.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    # --- Prepare a user with known credentials ---
+    with client.application.app_context():
+        test_user = User(user='testuser', password=ph.hash('hashed_password'))
+        db.session.add(test_user)
+        db.session.commit()
+        test_user_id = test_user.id
+
+    response = client.post('/auth/login', json={'user': 'testuser', 'password': 'hashed_password'})
+    token = response.json['token']
+
+    for _ in range(2):
+        response = client.get('/claims', headers={'Authorization': token})
+        assert response.status_code == 200
+        assert response.json == {'user_id': test_user_id, 'user': 'testuser'}
+
+def test_request_body_parsed_with_orjson(client, monkeypatch):
+    """
+    Test that request bodies are parsed by orjson, with a stdlib fallback.
+
+    This test case spies on `orjson.loads` while logging in and checks that it
+    parsed the body, then sends a UTF-16 encoded body that orjson rejects and
+    checks that it is still accepted.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+        monkeypatch (MonkeyPatch): Pytest fixture for patching attributes.
+
+    Returns:
+        None
+    """
+    calls = []
+    orjson_loads = orjson.loads
+
+    def spy_loads(s):
+        calls.append(s)
+        return orjson_loads(s)
+
+    monkeypatch.setattr(orjson, 'loads', spy_loads)
+
+    data = {'user': 'newuser', 'password': 'password123', 'first_name': 'John'}
+    response = client.post('/auth/sign-up', json=data)
+    assert response.status_code == 200
+    assert len(calls) == 1
+
+    # UTF-16 bodies are not valid for orjson and fall back to the stdlib parser
+    body = '{"user": "newuser", "password": "password123"}'.encode('utf-16')
+    response = client.post('/auth/login', data=body, content_type='application/json')
+    assert response.status_code == 200
+    assert 'token' in response.json
+
+def test_normalize_usernames_command(client):
+    """
+    Test the normalize-usernames CLI command.
+
+    This test case stores usernames written before normalization, including
+    two that collide once normalized, runs the command and checks that the
+    colliding rows are reported and left untouched while the others are
+    normalized.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    app = client.application
+
+    # --- Prepare users stored before normalization, bypassing the validator ---
+    with app.app_context():
+        db.session.execute(sa.insert(User), [
+            {'user': 'ALICE', 'password': 'x'},
+            {'user': 'alice', 'password': 'x'},
+            {'user': ' Bob ', 'password': 'x'},
+        ])
+        db.session.commit()
+
+    result = app.test_cli_runner(mix_stderr=False).invoke(args=['normalize-usernames'])
+    assert result.exit_code == 0
+    assert 'Normalized 1 username(s)' in result.stdout
+    assert "'ALICE', 'alice'" in result.stderr
+
+    with app.app_context():
+        users = set(db.session.execute(sa.select(User.user)).scalars())
+    assert users == {'ALICE', 'alice', 'bob'}
+
+def test_required_fields_must_be_strings(client):
+    """
+    Test login and registration with required fields that are not strings.
+
+    This test case sends null, numeric and empty values for required fields
+    and checks that each is reported in the `errors` response.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    data = {'user': None, 'password': None, 'first_name': 'John'}
+    response = client.post('/auth/sign-up', json=data)
+    assert response.status_code == 400
+    assert 'User must be a non-empty string' == response.json['errors']['user']
+    assert 'Password must be a non-empty string' == response.json['errors']['password']
+
+    data = {'user': 123, 'password': 'password123', 'first_name': ''}
+    response = client.post('/auth/sign-up', json=data)
+    assert response.status_code == 400
+    assert 'User must be a non-empty string' == response.json['errors']['user']
+    assert 'First_name must be a non-empty string' == response.json['errors']['first_name']
+
+    data = {'user': 'testuser', 'password': 123}
+    response = client.post('/auth/login', json=data)
+    assert response.status_code == 400
+    assert 'Password must be a non-empty string' == response.json['errors']['password']
+
+def test_secret_key_changed_after_create_app(client, monkeypatch):
+    """
+    Test that a SECRET_KEY set after `create_app` is used for tokens.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+        monkeypatch (MonkeyPatch): Pytest fixture for patching attributes.
+
+    Returns:
+        None
+    """
+    monkeypatch.setitem(client.application.config, 'SECRET_KEY', 'rotated_secret')
+
+    data = {'user': 'newuser', 'password': 'password123', 'first_name': 'John'}
+    client.post('/auth/sign-up', json=data)
+    response = client.post('/auth/login', json={'user': 'newuser', 'password': 'password123'})
+    token = response.json['token']
+
+    # The token is signed with the new key and accepted by token_required
+    jwt.decode(token, 'rotated_secret', algorithms=['HS256'])
+    response = client.get('/protected', headers={'Authorization': token})
+    assert response.status_code == 200
+
+def test_whitespace_only_username(client):
+    """
+    Test login and registration with a username made only of whitespace.
+
+    Usernames are normalized before validation, so a whitespace-only name is
+    rejected as empty instead of being stored or looked up as ''.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    data = {'user': '   ', 'password': 'password123', 'first_name': 'John'}
+    response = client.post('/auth/sign-up', json=data)
+    assert response.status_code == 400
+    assert 'User must be a non-empty string' == response.json['errors']['user']
+
+    data = {'user': ' ', 'password': 'password123'}
+    response = client.post('/auth/login', json=data)
+    assert response.status_code == 400
+    assert 'User must be a non-empty string' == response.json['errors']['user']
+
+def test_jwt_payload_is_serializable(client):
+    """
+    Test that a protected view can serialize `g.jwt_payload`.
+
+    This test case returns the payload from a protected view, once after
+    verifying the token and once from the cache, and checks the claims.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    data = {'user': 'newuser', 'password': 'password123', 'first_name': 'John'}
+    client.post('/auth/sign-up', json=data)
+    response = client.post('/auth/login', json={'user': 'newuser', 'password': 'password123'})
+    token = response.json['token']
+
+    for _ in range(2):
+        response = client.get('/payload', headers={'Authorization': token})
+        assert response.status_code == 200
+        assert set(response.json) == {'user_id', 'exp'}
+
+def test_corrupt_argon2_hash_login(client):
+    """
+    Test login for a user whose stored Argon2 hash is corrupt.
+
+    Args:
+        client (FlaskClient): The test client for making HTTP requests.
+
+    Returns:
+        None
+    """
+    # --- Prepare a user with a truncated hash ---
+    with client.application.app_context():
+        test_user = User(user='testuser', password='$argon2id$v=19$m=47104,t=1,p=1$garbage')
+        db.session.add(test_user)
+        db.session.commit()
+
+    response = client.post('/auth/login', json={'user': 'testuser', 'password': 'hashed_password'})
+    assert response.status_code == 400
+    assert 'Invalid credentials' == response.json['error']
+
+def test_load_passwords_csv(tmp_path):
+    """
+    Test reading the bulk rehash CSV file.
+
+    This test case checks that a header row is skipped, usernames are
+    normalized, and rows without exactly two fields are rejected.
+
+    Args:
+        tmp_path (Path): Pytest fixture providing a temporary directory.
+
+    Returns:
+        None
+    """
+    csv_path = tmp_path / 'passwords.csv'
+    csv_path.write_text('user,password\nAlice,new_alice\n\nbob,new_bob\n')
+    assert load_passwords(str(csv_path)) == {'alice': 'new_alice', 'bob': 'new_bob'}
+
+    csv_path.write_text('alice,new_alice\ncarol\n')
+    with pytest.raises(ValueError, match='line 2: expected 2 fields'):
+        load_passwords(str(csv_path))